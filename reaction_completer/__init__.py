@@ -1,4 +1,4 @@
 from reaction_completer.completer import ReactionCompleter
-from reaction_completer.driver import balance_recipe
+from reaction_completer.driver import balance_recipe, balance_recipe_cached, balance_recipes
 from reaction_completer.errors import *
 from reaction_completer.material import MaterialInformation
@@ -0,0 +1,88 @@
+# Linear solver used for symbolic reaction equations. SymEngine is used
+# when it is installed, otherwise everything is done by sympy.
+#
+from reaction_completer._cache import LRUCache
+
+__author__ = 'Haoyan Huo'
+__maintainer__ = 'Haoyan Huo'
+__email__ = 'haoyan.huo@lbl.gov'
+
+__all__ = ['solve_linear']
+
+_symengine = None
+
+# Maximum number of linear equations memorized by solve_linear()
+SOLUTION_CACHE_SIZE = 4096
+
+
+def _copy_solution(value):
+    if value is None:
+        return None
+    solution, params = value
+    return solution.copy(), params.copy()
+
+
+_solution_cache = LRUCache(SOLUTION_CACHE_SIZE, _copy_solution)
+
+
+def _load_symengine():
+    """
+    Import SymEngine on first use. Returns False if it is not installed.
+    """
+    global _symengine
+    if _symengine is None:
+        try:
+            import symengine
+            _symengine = symengine
+        except ImportError:
+            _symengine = False
+    return _symengine
+
+
+def solve_linear(a, b):
+    """
+    Solve the symbolic linear equation a * x = b, with the same semantics
+    as sympy's Matrix.gauss_jordan_solve().
+
+    SymEngine has no Gauss-Jordan elimination, so it is only used for
+    square systems without symbols and with a non-vanishing determinant,
+    i.e. when there is a unique solution. All other systems are handed
+    to sympy.
+
+    :param a: Coefficient matrix.
+    :type a: sympy.Matrix
+    :param b: Right hand side column vector.
+    :type b: sympy.Matrix
+    :return: Tuple of (solution, params), see gauss_jordan_solve().
+    :raises ValueError: The linear equation has no solution.
+    """
+    # Sympy expressions are hashable, so are the flattened matrices.
+    key = (a.shape, tuple(a), tuple(b))
+    value = _solution_cache.get(key, lambda: _solve_linear_or_none(a, b))
+    if value is None:
+        raise ValueError('Linear system has no solution.')
+    return value
+
+
+def _solve_linear_or_none(a, b):
+    # Systems without solution are memorized as None.
+    try:
+        return _solve_linear(a, b)
+    except ValueError:
+        return None
+
+
+def _solve_linear(a, b):
+    import sympy
+
+    # LU decomposition cannot cancel symbolic pivots, so SymEngine is only
+    # used when the coefficient matrix is numeric.
+    symengine = _load_symengine()
+    if symengine and a.rows == a.cols and not a.free_symbols:
+        se_a = symengine.Matrix(a)
+        if se_a.det().expand() != 0:
+            solution = se_a.LUsolve(symengine.Matrix(b))
+            solution = sympy.Matrix([x.expand()._sympy_() for x in solution])
+            return solution, sympy.Matrix(0, 1, [])
+
+    return a.gauss_jordan_solve(b)
@@ -0,0 +1,51 @@
+# Bounded least recently used cache shared by the reaction, recipe and
+# linear solution caches.
+#
+from collections import OrderedDict
+
+__author__ = 'Haoyan Huo'
+__maintainer__ = 'Haoyan Huo'
+__email__ = 'haoyan.huo@lbl.gov'
+
+__all__ = ['LRUCache']
+
+
+class LRUCache(object):
+    def __init__(self, maxsize, copy=None):
+        """
+        A dictionary that keeps at most maxsize values, dropping the least
+        recently used one when full.
+
+        :param maxsize: Maximum number of values, can be changed later
+            through the maxsize attribute.
+        :param copy: Function applied to a cached value before it is
+            returned, so that callers cannot modify the cached value.
+        """
+        self.maxsize = maxsize
+        self.copy = copy
+        self._values = OrderedDict()
+
+    def get(self, key, compute):
+        """
+        Return the value of key, calling compute() to create it when it is
+        not cached. Exceptions raised by compute() are not cached.
+        """
+        values = self._values
+        if key in values:
+            values.move_to_end(key)
+        else:
+            values[key] = compute()
+            while len(values) > self.maxsize:
+                values.popitem(last=False)
+
+        value = values[key]
+        return self.copy(value) if self.copy is not None else value
+
+    def clear(self):
+        self._values.clear()
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def __len__(self):
+        return len(self._values)
@@ -0,0 +1,118 @@
+import argparse
+import csv
+import json
+import pickle
+import sys
+from itertools import islice
+
+from reaction_completer.driver import balance_recipes
+
+__author__ = 'Haoyan Huo'
+__maintainer__ = 'Haoyan Huo'
+__email__ = 'haoyan.huo@lbl.gov'
+
+OUTPUT_COLUMNS = ['reaction', 'precursors', 'targets']
+
+
+def load_records(input_path):
+    """
+    Load extracted synthesis records from a pickle (.pkl) or JSON file.
+    The file holds a list of papers, each paper has a list of records
+    under the key "extracted_data". Every record has "precursors", a
+    "target" (a material dictionary or a list of them) and optionally
+    "sentences".
+
+    Records without precursors or target are skipped.
+
+    :param input_path: Path to the data file.
+    :return: Generator of records.
+    """
+    if input_path.endswith('.pkl'):
+        with open(input_path, 'rb') as f:
+            data = pickle.load(f)
+    else:
+        with open(input_path, encoding='utf-8') as f:
+            data = json.load(f)
+
+    for paper in data:
+        for record in paper['extracted_data']:
+            if record['precursors'] and record['target']:
+                yield record
+
+
+def _intern_material(material):
+    # Loaded strings are all distinct objects, intern the formulas and
+    # element symbols so that dictionary lookups compare by identity.
+    material['material_formula'] = sys.intern(material['material_formula'])
+    for composition in material['composition']:
+        composition['elements'] = {
+            sys.intern(element): amount
+            for element, amount in composition['elements'].items()}
+
+
+def _record_recipe(record):
+    targets = record['target']
+    if isinstance(targets, dict):
+        targets = [targets]
+    for material in record['precursors'] + targets:
+        _intern_material(material)
+    return record['precursors'], targets, record.get('sentences')
+
+
+def main(input_path, output_path=None, limit=None, processes=None):
+    """
+    Balance all recipes in a data file. If output_path is None, balanced
+    reactions are printed, otherwise they are written as CSV rows with
+    columns "reaction", "precursors" and "targets", one row per reaction.
+    Rows are written as soon as each recipe is balanced.
+
+    :param input_path: Path to the data file, see load_records().
+    :param output_path: Path to the CSV output file.
+    :param limit: Only balance the first "limit" records.
+    :param processes: Number of worker processes, see balance_recipes().
+    """
+    records = load_records(input_path)
+    if limit is not None:
+        records = islice(records, limit)
+    recipes = [_record_recipe(x) for x in records]
+
+    output_file = writer = None
+    if output_path is not None:
+        output_file = open(output_path, 'w', newline='', encoding='utf-8')
+        writer = csv.writer(output_file)
+        writer.writerow(OUTPUT_COLUMNS)
+
+    try:
+        for (precursors, targets, _), solutions in zip(recipes, balance_recipes(recipes, processes)):
+            for solution in solutions:
+                if writer is None:
+                    print(solution[3])
+                else:
+                    writer.writerow([
+                        solution[3],
+                        ', '.join(x['material_string'] for x in precursors),
+                        ', '.join(x['material_string'] for x in targets),
+                    ])
+    finally:
+        if output_file is not None:
+            output_file.close()
+
+
+def cli_main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Balance the reactions of extracted synthesis recipes.')
+    parser.add_argument('--input', required=True,
+                        help='Pickle (.pkl) or JSON file of extracted papers.')
+    parser.add_argument('--output', default=None,
+                        help='CSV file to write, reactions are printed if omitted.')
+    parser.add_argument('--limit', type=int, default=None,
+                        help='Only balance the first LIMIT records.')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='Number of worker processes, defaults to the number of CPUs.')
+    args = parser.parse_args(argv)
+
+    main(args.input, args.output, args.limit, args.processes)
+
+
+if __name__ == '__main__':
+    cli_main()
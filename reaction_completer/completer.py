@@ -2,18 +2,25 @@ import logging
 from functools import reduce
 from operator import or_
 
-import sympy
-from sympy import Matrix, symbols
+import numpy
 
+from reaction_completer._backend import solve_linear
 from reaction_completer.errors import (
     StupidRecipe, TooManyPrecursors, TooFewPrecursors)
 from reaction_completer.formatting import simplify_print
 from reaction_completer.material import MaterialInformation
+from reaction_completer.periodic_table import ELEMENT_INDEX
 
 __author__ = 'Haoyan Huo'
 __maintainer__ = 'Haoyan Huo'
 __email__ = 'haoyan.huo@lbl.gov'
 
+# Absolute tolerance used when solving purely numeric linear equations
+NUMERIC_TOLERANCE = 1e-8
+# Numeric solutions are rounded to this many decimals to remove the
+# floating point noise of LAPACK before coefficients are printed
+NUMERIC_DECIMALS = 10
+
 
 class ReactionCompleter(object):
     def __init__(self, precursors: [MaterialInformation],
@@ -37,12 +44,41 @@ class ReactionCompleter(object):
         self._precursor_candidates = []
         self._decomposition_chemicals = {}
         self._exchange_chemicals = {}
+        self._decomposition_keys = []
+        self._exchange_keys = []
         self._linear_eq = {}
 
         self._inspect_target()
         self._prepare_precursors()
         self._setup_linear_equation()
 
+    @staticmethod
+    def is_feasible(precursors, target, target_min_nv=2):
+        """
+        Cheap check of whether a set of precursors can possibly balance
+        the target, without setting up the linear equations. Returns False
+        when ReactionCompleter would certainly raise StupidRecipe, i.e.
+        the target has too few non volatile elements, or the usable
+        precursors do not provide all of them.
+
+        :param precursors: List of precursors.
+        :type precursors: list(MaterialInformation)
+        :param target: The target material.
+        :type target: MaterialInformation
+        :param target_min_nv:
+        :rtype: bool
+        """
+        if len(target.nv_elements) < target_min_nv:
+            return False
+
+        target_mask = target.nv_elements_mask
+        provided_mask = 0
+        for precursor in precursors:
+            precursor_mask = precursor.nv_elements_mask
+            if precursor.all_elements and not precursor_mask & ~target_mask:
+                provided_mask |= precursor_mask
+        return provided_mask == target_mask
+
     def _inspect_target(self):
         """
         Prepare the target material into a ready-to-use structure.
@@ -55,6 +91,7 @@ class ReactionCompleter(object):
     def _prepare_precursors(self):
         # find the set of precursors
 
+        target_mask = self.target.nv_elements_mask
         seen_precursors = set()
         for precursor in self.precursors:
             # Skip precursors that are seen
@@ -73,12 +110,12 @@ class ReactionCompleter(object):
                     precursor.material_formula)
                 continue
 
-            excessive = precursor.nv_elements - self.target.nv_elements
-            if len(excessive) > 0:
+            if precursor.nv_elements_mask & ~target_mask:
                 logging.debug(
                     'Skipping precursor %s because it '
                     'has excessive chemical elements %r',
-                    precursor.material_formula, excessive)
+                    precursor.material_formula,
+                    precursor.nv_elements - self.target.nv_elements)
                 continue
 
             self._precursor_candidates.append(precursor)
@@ -86,6 +123,9 @@ class ReactionCompleter(object):
 
         self._exchange_chemicals.update(self.target.exchange_chemicals)
 
+        self._decomposition_keys = sorted(self._decomposition_chemicals)
+        self._exchange_keys = sorted(self._exchange_chemicals)
+
         if len(self._precursor_candidates) == 0:
             raise StupidRecipe('Precursor candidates is empty')
 
@@ -99,56 +139,73 @@ class ReactionCompleter(object):
                 'provide non volatile elements: %r' % missing_elements)
 
     def _setup_linear_equation(self):
-        all_elements = reduce(
-            or_,
-            [x.all_elements for x in self._precursor_candidates] +
-            [self.target.all_elements] +
-            [set(x) for x in self._exchange_chemicals.values()] +
-            [set(x) for x in self._decomposition_chemicals.values()])
-        all_elements = sorted(list(all_elements))
-
-        # Create the symbols that will be used for linear eq.
-        chemical_symbols = ''
-        for i in range(len(self._precursor_candidates)):
-            chemical_symbols += 'p%d, ' % i
-        for i in range(len(self._decomposition_chemicals)):
-            chemical_symbols += 'r%d, ' % i
-        for i in range(len(self._exchange_chemicals)):
-            chemical_symbols += 'e%d, ' % i
-        chemical_symbols += 't'
-        chemical_symbols = symbols(chemical_symbols)
-
-        coefficient_matrix = []
-        which_side = []
+        import sympy
 
-        def fill_row(material_elements):
-            row = [material_elements.get(element, 0) for element in all_elements]
-            coefficient_matrix.append(row)
+        all_elements = set().union(
+            self.target.all_elements,
+            *[x.all_elements for x in self._precursor_candidates],
+            *self._exchange_chemicals.values(),
+            *self._decomposition_chemicals.values())
+        all_elements = sorted(all_elements)
 
-        for precursor in self._precursor_candidates:
-            fill_row(precursor.all_elements_dict)
-            which_side.append('fl')
-
-        for chemical in sorted(self._decomposition_chemicals):
-            fill_row(self._decomposition_chemicals[chemical])
-            which_side.append('dr')
-
-        for chemical in sorted(self._exchange_chemicals):
-            fill_row(self._exchange_chemicals[chemical])
-            which_side.append('dl')
-
-        target_elements = self.target.all_elements_dict
-        target_vector = [target_elements.get(i, 0) for i in all_elements]
-
-        coefficient_matrix = Matrix(coefficient_matrix).T
-
-        target_vector = Matrix(target_vector)
+        # Create the symbols that will be used for linear eq.
+        names = ['p%d' % i for i in range(len(self._precursor_candidates))]
+        names += ['r%d' % i for i in range(len(self._decomposition_chemicals))]
+        names += ['e%d' % i for i in range(len(self._exchange_chemicals))]
+        names.append('t')
+        chemical_symbols = sympy.symbols(names)
+
+        chemicals = [self._decomposition_chemicals[x].items() for x in self._decomposition_keys]
+        chemicals += [self._exchange_chemicals[x].items() for x in self._exchange_keys]
+        which_side = (
+            ['fl'] * len(self._precursor_candidates) +
+            ['dr'] * len(self._decomposition_keys) +
+            ['dl'] * len(self._exchange_keys))
+        # Use LAPACK instead of sympy when no symbols are involved.
+        # Decomposition and exchange chemicals are always numeric.
+        is_numeric = self.target.is_numeric and all(
+            x.is_numeric for x in self._precursor_candidates)
+        n_precursors = len(self._precursor_candidates)
+        shape = (len(all_elements), n_precursors + len(chemicals))
+
+        element_index = {element: i for i, element in enumerate(all_elements)}
+        if is_numeric:
+            coefficient_matrix = numpy.zeros(shape, dtype=numpy.float64)
+            target_vector = numpy.zeros(shape[0], dtype=numpy.float64)
+
+            # Scatter the packed arrays of precursors and target over the
+            # whole periodic table, then keep the rows of used elements.
+            # Charges such as "e-" only appear in decomposition chemicals.
+            rows, table_rows = zip(*[
+                (i, ELEMENT_INDEX[x]) for i, x in enumerate(all_elements) if x in ELEMENT_INDEX])
+            rows, table_rows = list(rows), list(table_rows)
+            table = numpy.zeros((len(ELEMENT_INDEX), n_precursors + 1), dtype=numpy.float64)
+            for j, material in enumerate(self._precursor_candidates + [self.target]):
+                indices, amounts = material.packed_elements
+                table[indices, j] = amounts
+            coefficient_matrix[rows, :n_precursors] = table[table_rows, :n_precursors]
+            target_vector[rows] = table[table_rows, n_precursors]
+        else:
+            coefficient_matrix = sympy.zeros(*shape)
+            target_vector = sympy.zeros(shape[0], 1)
+
+            for j, precursor in enumerate(self._precursor_candidates):
+                for element, amount in precursor.sparse_elements:
+                    coefficient_matrix[element_index[element], j] = amount
+            for element, amount in self.target.sparse_elements:
+                target_vector[element_index[element]] = amount
+
+        # Only fill non-zero entries, one column per chemical.
+        for j, chemical in enumerate(chemicals, n_precursors):
+            for element, amount in chemical:
+                coefficient_matrix[element_index[element], j] = amount
 
         self._linear_eq.update({
+            'is_numeric': is_numeric,
             'chemical_symbols': chemical_symbols,
             'coefficient_matrix': coefficient_matrix,
             'target_vector': target_vector,
-            'which_side': which_side,
+            'which_side': tuple(which_side),
             'all_elements': all_elements,
         })
 
@@ -158,21 +215,23 @@ class ReactionCompleter(object):
             'right': {self.target.material_formula: '1'}
         }
 
-        solution = list(solution)
+        solution = tuple(solution)
         which_side = self._linear_eq['which_side']
+        n_p = len(self._precursor_candidates)
+        n_pd = n_p + len(self._decomposition_chemicals)
 
-        precursor_solutions = solution[:len(self._precursor_candidates)]
-        precursor_side = which_side[:len(self._precursor_candidates)]
-        del solution[:len(self._precursor_candidates)]
-        del which_side[:len(self._precursor_candidates)]
+        precursor_solutions = solution[:n_p]
+        precursor_side = which_side[:n_p]
 
-        decomposition_solutions = solution[:len(self._decomposition_chemicals)]
-        decomposition_side = which_side[:len(self._decomposition_chemicals)]
-        del solution[:len(self._decomposition_chemicals)]
-        del which_side[:len(self._decomposition_chemicals)]
+        decomposition_solutions = solution[n_p:n_pd]
+        decomposition_side = which_side[n_p:n_pd]
 
-        exchange_solutions = solution.copy()
-        exchange_side = which_side.copy()
+        exchange_solutions = solution[n_pd:]
+        exchange_side = which_side[n_pd:]
+
+        # Values of the free symbols used to decide the sign of a coefficient.
+        free_symbols = set().union(*[x.free_symbols for x in solution])
+        sign_subs = {x: 0.001 for x in free_symbols}
 
         def decide_side_value(s, val):
             if s[0] == 'f':
@@ -181,9 +240,8 @@ class ReactionCompleter(object):
                 elif s[1] == 'r':
                     return 'right', -val
             elif s[0] == 'd':
-                if not isinstance(val, sympy.Float):
-                    value_zero = val.evalf(
-                        subs={x: 0.001 for x in val.free_symbols})
+                if val.free_symbols:
+                    value_zero = val.evalf(subs=sign_subs)
                     value_negative = float(value_zero) < 0
                 else:
                     value_negative = float(val) < 0
@@ -203,7 +261,7 @@ class ReactionCompleter(object):
                 balanced[side][material_formula] = value_s
 
         for chemical, amount, side in zip(
-                sorted(self._decomposition_chemicals), decomposition_solutions, decomposition_side):
+                self._decomposition_keys, decomposition_solutions, decomposition_side):
             side, value = decide_side_value(side, amount)
 
             value_s = simplify_print(value)
@@ -211,7 +269,7 @@ class ReactionCompleter(object):
                 balanced[side][chemical] = value_s
 
         for chemical, amount, side in zip(
-                sorted(self._exchange_chemicals), exchange_solutions, exchange_side):
+                self._exchange_keys, exchange_solutions, exchange_side):
             side, value = decide_side_value(side, amount)
 
             value_s = simplify_print(value)
@@ -220,17 +278,40 @@ class ReactionCompleter(object):
 
         return balanced
 
+    def _too_many_precursors(self):
+        return TooManyPrecursors(
+            'Too many precursors to balance %r ==> %r' % (
+                [x.material_formula for x in self.precursors],
+                self.target.material_formula))
+
+    def _solve_numeric(self, a, b):
+        import sympy
+
+        solution, _, rank, _ = numpy.linalg.lstsq(a, b, rcond=None)
+
+        if not numpy.allclose(a @ solution, b, rtol=0, atol=NUMERIC_TOLERANCE):
+            raise TooFewPrecursors('Too few precursors to balance')
+        if rank < a.shape[1]:
+            raise self._too_many_precursors()
+
+        # Without rounding, 1-ulp noise decides how coefficients such as
+        # 0.0375 are rounded when printed, and it depends on the BLAS used.
+        solution = numpy.round(solution, NUMERIC_DECIMALS)
+        return [sympy.Integer(0) if abs(x) < NUMERIC_TOLERANCE else sympy.Float(x)
+                for x in solution]
+
     def compute_reactions(self):
+        a = self._linear_eq['coefficient_matrix']
+        b = self._linear_eq['target_vector']
+
+        if self._linear_eq['is_numeric']:
+            return self._render_reaction(self._solve_numeric(a, b))
+
         try:
-            a = self._linear_eq['coefficient_matrix']
-            b = self._linear_eq['target_vector']
-            solution, params = a.gauss_jordan_solve(b)
+            solution, params = solve_linear(a, b)
 
             if len(params) > 0:
-                raise TooManyPrecursors(
-                    'Too many precursors to balance %r ==> %r' % (
-                        [x.material_formula for x in self.precursors],
-                        self.target.material_formula))
+                raise self._too_many_precursors()
 
             solution = solution.T[:1, :]
         except ValueError:
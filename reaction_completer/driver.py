@@ -2,20 +2,46 @@ import logging
 import re
 from collections import defaultdict
 from functools import reduce
+from multiprocessing import Pool
 from operator import or_
 from tokenize import TokenError
-from nltk.metrics.distance import edit_distance
 from reaction_completer import ReactionCompleter
+from reaction_completer._cache import LRUCache
 from reaction_completer.errors import (
     TooFewPrecursors, TooManyPrecursors,
     CannotBalance, FormulaException)
 from reaction_completer.formatting import render_reaction
-from reaction_completer.material import MaterialInformation
+from reaction_completer.material import material_dict_to_info
+from reaction_completer.periodic_table import NON_VOLATILE_ELEMENTS
 
 __author__ = 'Haoyan Huo'
 __maintainer__ = 'Haoyan Huo'
 __email__ = 'haoyan.huo@lbl.gov'
 
+# Maximum number of balanced reactions memorized by compute_reactions_cached()
+REACTION_CACHE_SIZE = 4096
+# Maximum number of recipes memorized by balance_recipe_cached()
+RECIPE_CACHE_SIZE = 65536
+
+
+def _copy_reaction(reaction):
+    return {side: dict(materials) for side, materials in reaction.items()}
+
+
+def _copy_solutions(solutions):
+    return [
+        (formula, _copy_reaction(reaction),
+         dict(substitution) if substitution is not None else None,
+         reaction_string)
+        for formula, reaction, substitution, reaction_string in solutions
+    ]
+
+
+_reaction_cache = LRUCache(
+    REACTION_CACHE_SIZE,
+    lambda value: (_copy_reaction(value[0]),) + value[1:])
+_recipe_cache = LRUCache(RECIPE_CACHE_SIZE, _copy_solutions)
+
 
 def substitute_element_vars(targets):
     # Generate all possible combinations of (target, element_substitution)
@@ -34,19 +60,6 @@ def substitute_element_vars(targets):
     return targets_to_balance
 
 
-def material_dict_to_info(material_dict, sub_dict=None):
-    compositions = []
-    for comp in material_dict['composition']:
-        compositions.append({
-            'amount': comp['amount'],
-            'elements': comp['elements'],
-        })
-    return MaterialInformation(
-        material_dict['material_string'],
-        material_dict['material_formula'],
-        compositions, sub_dict)
-
-
 def screen_good_precursors(precursors):
     precursor_objects = []
     for precursor in precursors:
@@ -59,10 +72,106 @@ def screen_good_precursors(precursors):
     return precursor_objects
 
 
-def try_balance(precursors_to_balance, target, substitution, all_precursors):
-    target_to_balance = material_dict_to_info(target, substitution)
-    completer = ReactionCompleter(precursors_to_balance, target_to_balance)
-    solution = completer.compute_reactions()
+def _freeze_chemicals(chemicals):
+    return tuple(sorted(
+        (name, tuple(sorted(composition.items())))
+        for name, composition in chemicals.items()))
+
+
+def _structure_key(material, relabel):
+    return (
+        tuple(sorted((relabel.get(element, element), str(amount))
+                     for element, amount in material.sparse_elements)),
+        _freeze_chemicals(material.decompose_chemicals))
+
+
+def _reaction_key(precursors, target):
+    """
+    Key of the linear equations that ReactionCompleter(precursors, target)
+    would solve, up to the names of materials and the substituted
+    elements. Targets with element substitutions such as A = Fe and A = Al
+    usually lead to the same equations once Fe2O3 and Al2O3 are both
+    written as A2O3, so they are solved only once.
+
+    :return: (key, precursor formulas in the order of the key), or
+        (None, None) if material names cannot be safely relabeled.
+    """
+    # Substituted non volatile elements are relabeled by their variable,
+    # as long as every variable has a distinct element.
+    relabel = {
+        element: '*' + variable
+        for variable, element in target.substitution_dict.items()
+        if element in NON_VOLATILE_ELEMENTS}
+    if len(relabel) != len(target.substitution_dict):
+        relabel = {}
+
+    # Same filtering as ReactionCompleter: the first precursor of each
+    # formula, and only the ones without excessive non volatile elements.
+    target_mask = target.nv_elements_mask
+    seen_formulas = set()
+    candidates = []
+    for precursor in precursors:
+        if precursor.material_formula in seen_formulas:
+            continue
+        seen_formulas.add(precursor.material_formula)
+        if precursor.all_elements and not precursor.nv_elements_mask & ~target_mask:
+            candidates.append((_structure_key(precursor, relabel), precursor.material_formula))
+    candidates.sort()
+
+    # Material names are relabeled in the solution, which is only
+    # possible when they cannot be mistaken for each other or for
+    # by-product chemicals.
+    chemicals = set(target.exchange_chemicals)
+    for precursor_key, _ in candidates:
+        chemicals.update(name for name, _ in precursor_key[1])
+    if target.material_formula in chemicals or seen_formulas & chemicals:
+        return None, None
+    if target.material_formula in seen_formulas:
+        return None, None
+
+    key = (tuple(x for x, _ in candidates),
+           _structure_key(target, relabel),
+           _freeze_chemicals(target.exchange_chemicals))
+    return key, [x for _, x in candidates]
+
+
+def compute_reactions_cached(precursors, target):
+    """
+    Same as ReactionCompleter(precursors, target).compute_reactions(), but
+    memorizes the balanced reactions so that identical (precursors, target)
+    combinations, which appear frequently when trying element substitutions
+    and precursor subsets, are solved only once. Combinations that only
+    differ by material names or substituted elements share the same
+    solution, with the material names relabeled.
+
+    Failures are not cached, the exception is raised every time.
+
+    :param precursors: List of precursors.
+    :type precursors: list(MaterialInformation)
+    :param target: The target material.
+    :type target: MaterialInformation
+    :return: Balanced reaction dictionary.
+    """
+    key, formulas = _reaction_key(precursors, target)
+    if key is None:
+        return ReactionCompleter(precursors, target).compute_reactions()
+
+    solution, cached_formulas, cached_target_formula = _reaction_cache.get(
+        key, lambda: (ReactionCompleter(precursors, target).compute_reactions(),
+                      formulas, target.material_formula))
+    relabel = dict(zip(cached_formulas, formulas))
+    relabel[cached_target_formula] = target.material_formula
+    return {
+        side: {relabel.get(name, name): amount for name, amount in materials.items()}
+        for side, materials in solution.items()
+    }
+
+
+def try_balance(precursors_to_balance, target, substitution, all_precursors,
+                target_to_balance=None):
+    if target_to_balance is None:
+        target_to_balance = material_dict_to_info(target, substitution)
+    solution = compute_reactions_cached(precursors_to_balance, target_to_balance)
 
     return (
         target_to_balance.material_formula,
@@ -72,45 +181,91 @@ def try_balance(precursors_to_balance, target, substitution, all_precursors):
     )
 
 
+def edit_distance_below(s1, s2, limit):
+    """
+    Check whether the Levenshtein distance between two strings is smaller
+    than limit. Common prefix/suffix are skipped and the dynamic programming
+    stops as soon as a whole row reaches the limit.
+
+    :param s1: First string.
+    :param s2: Second string.
+    :param limit: Upper bound (exclusive) of the edit distance.
+    :rtype: bool
+    """
+    prefix = 0
+    while prefix < len(s1) and prefix < len(s2) and s1[prefix] == s2[prefix]:
+        prefix += 1
+    s1, s2 = s1[prefix:], s2[prefix:]
+    suffix = 0
+    while suffix < len(s1) and suffix < len(s2) and s1[-1 - suffix] == s2[-1 - suffix]:
+        suffix += 1
+    s1, s2 = s1[:len(s1) - suffix], s2[:len(s2) - suffix]
+
+    if abs(len(s1) - len(s2)) >= limit:
+        return False
+
+    previous = list(range(len(s2) + 1))
+    for i, c1 in enumerate(s1, 1):
+        current = [i]
+        for j, c2 in enumerate(s2, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (c1 != c2)))
+        if min(current) >= limit:
+            return False
+        previous = current
+    return previous[-1] < limit
+
+
 def find_precursors_in_same_sentence(precursors_to_balance, sentences):
     """
     Try to eliminate the precursors not in the same sentence.
     Also finds sets that don't come from a material name (such as manganese nitrates).
     """
     precursor_candidates = []
+    seen_candidates = set()
+
+    def add_candidates(candidates):
+        # Different heuristics often find the same set of precursors,
+        # only keep the first one.
+        key = frozenset(id(x) for x in candidates)
+        if candidates and key not in seen_candidates:
+            seen_candidates.add(key)
+            precursor_candidates.append(candidates)
 
     def is_word_material(m):
         return bool(re.match(r'^[\w\s()]+$', m.material_string))
 
-    for sentence in sentences:
-        candidates = []
-        for precursor in precursors_to_balance:
-            if precursor.material_formula in sentence:
-                candidates.append(precursor)
-        if candidates:
-            precursor_candidates.append(candidates)
+    # Edit distance is expensive, compute it once per precursor.
+    no_conversion_cache = {}
+
+    def is_no_conversion(m):
+        if id(m) not in no_conversion_cache:
+            no_conversion_cache[id(m)] = edit_distance_below(
+                m.material_formula, m.material_string, len(m.material_string) * 0.5)
+        return no_conversion_cache[id(m)]
 
-        candidates_no_conversion = [
-            x for x in candidates
-            if edit_distance(x.material_formula, x.material_string) < len(x.material_string) * 0.5]
-        if candidates_no_conversion:
-            precursor_candidates.append(candidates_no_conversion)
+    # Formulas and material strings are often identical, so look up each
+    # distinct pattern only once per sentence.
+    patterns = set()
+    for precursor in precursors_to_balance:
+        patterns.add(precursor.material_formula)
+        patterns.add(precursor.material_string)
+    sentence_patterns = [{x for x in patterns if x in sentence} for sentence in sentences]
+
+    for found in sentence_patterns:
+        candidates = [x for x in precursors_to_balance if x.material_formula in found]
+        add_candidates(candidates)
+        add_candidates([x for x in candidates if is_no_conversion(x)])
 
     # Find the list of precursors that are in the same sentence
-    for sentence in sentences:
-        candidates = []
-        for precursor in precursors_to_balance:
-            if precursor.material_string in sentence:
-                candidates.append(precursor)
-
-        candidates_no_conversion = [
-            x for x in candidates
-            if edit_distance(x.material_formula, x.material_string) < len(x.material_string) * 0.5]
-        if candidates_no_conversion:
-            precursor_candidates.append(candidates_no_conversion)
+    for found in sentence_patterns:
+        candidates = [x for x in precursors_to_balance if x.material_string in found]
+        add_candidates([x for x in candidates if is_no_conversion(x)])
 
         if candidates:
-            precursor_candidates.append(candidates)
+            add_candidates(candidates)
 
             # Make a copy of materials that don't come from English words
             # if a similar material has been found.
@@ -128,7 +283,7 @@ def find_precursors_in_same_sentence(precursors_to_balance, sentences):
             candidates_no_words = []
             for i in materials_by_chemistry.values():
                 candidates_no_words.extend(i)
-            precursor_candidates.append(candidates_no_words)
+            add_candidates(candidates_no_words)
 
     return precursor_candidates
 
@@ -250,6 +405,11 @@ def balance_recipe(precursors, targets, sentences=None):
     targets_to_balance = substitute_element_vars(targets)
     precursors_to_balance = screen_good_precursors(precursors)
 
+    # Fallback precursor subsets do not depend on the target, so they are
+    # computed at most once and shared by all targets and substitutions.
+    inorganic_precursors = None
+    sentence_candidates = None
+
     solutions = []
     for target, substitution in targets_to_balance:
         try:
@@ -260,12 +420,14 @@ def balance_recipe(precursors, targets, sentences=None):
             continue
 
         try:
-            solution = try_balance(precursors_to_balance, target, substitution, precursors)
+            solution = try_balance(precursors_to_balance, target, substitution, precursors, target_object)
             solutions.append(solution)
         except TooFewPrecursors:
-            precursor_candidates = list(filter(lambda x: not x.is_hco, precursors_to_balance))
+            if inorganic_precursors is None:
+                inorganic_precursors = [x for x in precursors_to_balance if not x.is_hco]
+            precursor_candidates = inorganic_precursors
             try:
-                solution = try_balance(precursor_candidates, target, substitution, precursors)
+                solution = try_balance(precursor_candidates, target, substitution, precursors, target_object)
                 solutions.append(solution)
             except (CannotBalance, TokenError) as e_subset:
                 logging.debug(
@@ -274,7 +436,9 @@ def balance_recipe(precursors, targets, sentences=None):
                     target_object.material_formula,
                     [x.material_formula for x in precursor_candidates], e_subset)
         except TooManyPrecursors as e:
-            precursor_candidates = find_precursors_in_same_sentence(precursors_to_balance, sentences)
+            if sentence_candidates is None:
+                sentence_candidates = find_precursors_in_same_sentence(precursors_to_balance, sentences)
+            precursor_candidates = sentence_candidates
 
             if not precursor_candidates:
                 logging.debug('No possible precursor subsets for target: %s, precursors: %r: %r',
@@ -285,8 +449,15 @@ def balance_recipe(precursors, targets, sentences=None):
                 # Iterate over all candidate precursors, and find the first success
                 # reaction that can be completed.
                 for candidates in precursor_candidates:
+                    if not ReactionCompleter.is_feasible(candidates, target_object):
+                        logging.debug(
+                            'Skipping infeasible precursor subset for target: %s, '
+                            'precursors: %r',
+                            target_object.material_formula,
+                            [x.material_formula for x in candidates])
+                        continue
                     try:
-                        solution = try_balance(candidates, target, substitution, precursors)
+                        solution = try_balance(candidates, target, substitution, precursors, target_object)
                         solutions.append(solution)
                         success = True
                         break
@@ -312,3 +483,67 @@ def balance_recipe(precursors, targets, sentences=None):
                             target_object.material_formula,
                             [x.material_formula for x in precursors_to_balance], e)
     return solutions
+
+
+def _freeze(obj):
+    if isinstance(obj, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in obj.items()))
+    if isinstance(obj, (list, tuple)):
+        return tuple(_freeze(x) for x in obj)
+    return obj
+
+
+def balance_recipe_cached(precursors, targets, sentences=None):
+    """
+    Same as balance_recipe(precursors, targets, sentences), but memorizes
+    the solutions so that recipes repeated across papers are balanced only
+    once.
+
+    Sentences only matter through the precursor names they contain, so
+    the cache key records which precursor formulas/strings appear in each
+    sentence instead of the sentences themselves.
+
+    :param precursors: List of precursors
+    :param targets: List of targets
+    :param sentences: List of sentences
+    :return: List of solutions, same as balance_recipe().
+    """
+    patterns = set()
+    for precursor in precursors:
+        patterns.add(precursor['material_formula'])
+        patterns.add(precursor['material_string'])
+    sentence_key = tuple(
+        frozenset(x for x in patterns if x in sentence)
+        for sentence in sentences or [])
+    key = (_freeze(precursors), _freeze(targets), sentence_key)
+
+    return _recipe_cache.get(key, lambda: balance_recipe(precursors, targets, sentences))
+
+
+def _balance_recipe_args(args):
+    return balance_recipe_cached(*args)
+
+
+def balance_recipes(recipes, processes=None, chunksize=64):
+    """
+    Balance many independent recipes, using a pool of worker processes.
+    Each recipe is a tuple (precursors, targets) or (precursors, targets,
+    sentences), the same as the arguments of balance_recipe(). Solutions
+    are yielded in the same order as the recipes.
+
+    Every worker process keeps its own cache of balanced recipes.
+
+    :param recipes: Iterable of recipes.
+    :param processes: Number of worker processes, defaults to the number
+        of CPUs. If 1, recipes are balanced in the current process.
+    :param chunksize: Number of recipes sent to a worker at once.
+    :return: Generator of solution lists, same as balance_recipe().
+    """
+    if processes == 1:
+        for recipe in recipes:
+            yield _balance_recipe_args(recipe)
+        return
+
+    with Pool(processes) as pool:
+        for solutions in pool.imap(_balance_recipe_args, recipes, chunksize=chunksize):
+            yield solutions
@@ -1,14 +1,16 @@
 import re
-
-import sympy
-from sympy.core.numbers import NegativeOne, One, Zero
-from sympy.printing.precedence import precedence
+from typing import TYPE_CHECKING
 
 from reaction_completer.errors import ExpressionPrintException, FormulaException
-from reaction_completer.material import MaterialInformation
+from reaction_completer.material import material_dict_to_info
 from reaction_completer.periodic_table import ELEMENTS
 
+if TYPE_CHECKING:
+    import sympy
+
 FLOAT_ROUND = 3  # 3 decimal places 0.001
+# Integer valued floats below this bound are printed exactly as int
+_MAX_EXACT_FLOAT_INT = 2 ** 53
 _FLOAT_RE = re.compile(r"""
         (?P<sign>[-+])?             # Sign of the float
         (?=\d|\.\d)                 # Make sure there is some number following 
@@ -24,22 +26,28 @@ def nicely_print_float(f_s):
     :param f_s: string of the float number.
     :return:
     """
+    # Fast path for plain integers, such as "3" or "-2".
+    if f_s.lstrip('-').isdigit():
+        return f_s
+
     m = _FLOAT_RE.match(f_s)
     if not m:
         raise ValueError('This is not a float!')
 
     integer = m.group('int') or '0'
     fraction = m.group('frac') or ''
-    exp = int(m.group('exp') or 0)
+    exp = m.group('exp')
     sign = m.group('sign') or ''
 
-    while exp > 0:
-        if len(fraction):
-            integer += fraction[0]
-            fraction = fraction[1:]
-        else:
-            integer += '0'
-        exp -= 1
+    if exp is not None:
+        exp = int(exp)
+        while exp > 0:
+            if len(fraction):
+                integer += fraction[0]
+                fraction = fraction[1:]
+            else:
+                integer += '0'
+            exp -= 1
     fraction = fraction.rstrip('0')
     sign = '-' if sign == '-' else ''
     floating_number = sign + integer + ('.' + fraction if len(fraction) else '')
@@ -47,71 +55,108 @@ def nicely_print_float(f_s):
     return floating_number
 
 
-def simplify_print(expr: sympy.Expr):
-    if isinstance(expr, sympy.Float):
-        # Just a float number.
-        return nicely_print_float(
-            str(expr.round(FLOAT_ROUND)))
-    elif isinstance(expr, sympy.Add):
-        expression = ''
-        for i, ele in enumerate(expr.args):
-            ele_str = simplify_print(ele)
+def _make_printer():
+    """
+    Create the printer used by simplify_print(). sympy is imported here
+    so that importing this module does not pay for it.
+    """
+    import sympy
+    from sympy.printing.precedence import precedence
+    from sympy.printing.str import StrPrinter
+
+    class _SimplifyPrinter(StrPrinter):
+        """
+        Compact printer for reaction coefficients: floats are rounded to
+        FLOAT_ROUND digits, rationals are printed as floats and no whitespace
+        is put around operators.
+        """
+        _supported_types = (sympy.Float, sympy.Rational, sympy.Add, sympy.Mul, sympy.Symbol)
+
+        def _print(self, expr, **kwargs):
+            if not isinstance(expr, self._supported_types):
+                raise ExpressionPrintException(
+                    'Do not know how to print %r: %r' % (type(expr), expr))
+            return super(_SimplifyPrinter, self)._print(expr, **kwargs)
+
+        def _print_Float(self, expr):
+            value = float(expr)
+            # Beyond 2**53 the float no longer holds the exact decimal digits
+            if value.is_integer() and abs(value) < _MAX_EXACT_FLOAT_INT:
+                return str(int(value))
+            return nicely_print_float(str(expr.round(FLOAT_ROUND)))
+
+        def _print_Integer(self, expr):
+            return str(expr.p)
+
+        def _print_Rational(self, expr):
+            return self._print(expr.evalf())
+
+        def _print_Add(self, expr, order=None):
+            expression = ''
+            for ele in expr.args:
+                ele_str = self._print(ele)
+
+                if ele_str == '0':
+                    continue
+
+                if ele_str[0] == '-' or expression == '':
+                    expression += ele_str
+                else:
+                    expression += '+' + ele_str
+
+            return expression or '0'
+
+        def _print_Mul(self, expr):
+            coefficient, _ = expr.as_coeff_Mul()
+            if coefficient < 0:
+                expr = -expr
+                sign = '-'
+            else:
+                sign = ''
 
-            if ele_str == '0':
-                continue
+            level = precedence(expr)
+            exps = []
+            for arg in expr.as_ordered_factors():
+                exp = self._print(arg)
+                if exp == '0':
+                    return '0'
+                if exp != '1':
+                    if precedence(arg) < level:
+                        exp = '(%s)' % exp
+                    exps.append(exp)
 
-            if ele_str[0] == '-' or expression == '':
-                expression += ele_str
-            else:
-                expression += '+' + ele_str
-
-        if expression == '':
-            return '0'
-        else:
-            return expression
-    elif isinstance(expr, sympy.Mul):
-        coefficient, _ = expr.as_coeff_Mul()
-        if coefficient < 0:
-            expr = -expr
-            sign = '-'
-        else:
-            sign = ''
-
-        exps = []
-        for arg in expr.as_ordered_factors():
-            exp = simplify_print(arg)
-            if exp == '0':
-                return '0'
-            if exp != '1':
-                if precedence(arg) < precedence(expr):
-                    exp = '(%s)' % exp
-                exps.append(exp)
-
-        expression = sign + '*'.join(exps)
-        return expression
-    elif isinstance(expr, NegativeOne):
-        return '-1'
-    elif isinstance(expr, One):
-        return '1'
-    elif isinstance(expr, Zero):
-        return '0'
-    elif isinstance(expr, sympy.Symbol):
-        return expr.name
-    elif isinstance(expr, sympy.Integer):
-        return str(expr.p)
-    elif isinstance(expr, sympy.Rational):
-        return simplify_print(expr.evalf())
-    else:
-        raise ExpressionPrintException(
-            'Do not know how to print %r: %r' % (type(expr), expr))
-
-
-ions_regex = re.compile('|'.join(sorted(ELEMENTS, key=lambda x: (-len(x), x))))
+            return sign + '*'.join(exps)
+
+    return _SimplifyPrinter()
+
+
+_PRINTER = None
+
+
+def simplify_print(expr: 'sympy.Expr'):
+    global _PRINTER
+    if _PRINTER is None:
+        _PRINTER = _make_printer()
+    return _PRINTER.doprint(expr)
+
+
+# All element symbols are a capital letter with an optional lowercase letter.
+ions_regex = re.compile(r'[A-Z][a-z]?')
 OMIT_IONS = {'O', 'H', 'N'}
 
 
 def find_ions(string):
-    return ions_regex.findall(string)
+    """
+    Find all chemical elements in a string, preferring two-letter symbols.
+    Scans the string once instead of trying every element at each position.
+    """
+    ions = []
+    for candidate in ions_regex.findall(string):
+        if candidate in ELEMENTS:
+            ions.append(candidate)
+        elif candidate[0] in ELEMENTS:
+            ions.append(candidate[0])
+    return ions
 
 
 def render_reaction(precursors, target, reaction, element_substitution=None):
@@ -143,18 +188,8 @@ def render_reaction(precursors, target, reaction, element_substitution=None):
         additive_precursors = []
 
         for precursor in precursors:
-            compositions = []
-            for comp in precursor['composition']:
-                compositions.append({
-                    'amount': comp['amount'],
-                    'elements': comp['elements'],
-                })
-
             try:
-                mat_info = MaterialInformation(
-                    precursor['material_string'],
-                    precursor['material_formula'],
-                    compositions)
+                mat_info = material_dict_to_info(precursor)
 
                 if mat_info.all_elements and \
                         any(x in additive_ions for x in mat_info.all_elements):
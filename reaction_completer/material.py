@@ -1,16 +1,52 @@
+import math
+import sys
+from fractions import Fraction
+from functools import lru_cache
 from tokenize import TokenError
+from types import MappingProxyType
 
-from sympy.parsing.sympy_parser import parse_expr
+import numpy
 
 from reaction_completer.errors import FormulaException
-from reaction_completer.periodic_table import NON_VOLATILE_ELEMENTS, ELEMENTS
+from reaction_completer.periodic_table import NON_VOLATILE_ELEMENTS, ELEMENTS, ELEMENT_INDEX
 
 __author__ = 'Haoyan Huo'
 __maintainer__ = 'Haoyan Huo'
 __email__ = 'haoyan.huo@lbl.gov'
 
 
+@lru_cache(maxsize=4096)
+def _cached_parse(amount_s):
+    """
+    Memorized parse_expr(). Amount strings such as '1.0' or '1-x' repeat a
+    lot, and sympy expressions are immutable, so they can be shared.
+    Plain numbers are returned as Python int/float without importing sympy,
+    integer valued amounts such as '3.0' are returned as int.
+    """
+    try:
+        return int(amount_s)
+    except ValueError:
+        pass
+    try:
+        value = float(amount_s)
+        if math.isfinite(value):
+            return int(value) if value.is_integer() else value
+    except ValueError:
+        pass
+
+    from sympy.parsing.sympy_parser import parse_expr
+    return parse_expr(amount_s)
+
+
 class MaterialInformation(object):
+    __slots__ = (
+        'material_string', 'material_formula', 'material_composition',
+        'substitution_dict', 'non_volatile_elements', 'other_elements',
+        '_nv_elements', '_v_elements', '_all_elements', '_all_elements_dict',
+        '_nv_mask', '_sparse', '_is_numeric', '_packed', '_found_components',
+        '_decompose_chemicals', '_exchange_chemicals',
+    )
+
     def __init__(self, material_string, material_formula,
                  material_composition, substitution_dict=None):
         """
@@ -58,19 +94,20 @@ class MaterialInformation(object):
         # Ensure the composition has right data types
         all_elements = set()
         for composition in material_composition:
-            if set(composition.keys()) != {'amount', 'elements'}:
+            if len(composition) != 2 or 'amount' not in composition or 'elements' not in composition:
                 raise ValueError('Illegal composition dictionary %r. '
                                  'You should only put keys "amount" '
                                  'and "elements"' % set(composition.keys()))
-            if not isinstance(composition['amount'], str):
+            if type(composition['amount']) is not str:
                 composition['amount'] = str(composition['amount'])
 
-            for element, amount in composition['elements'].items():
-                all_elements.add(element)
-                if not isinstance(element, str):
+            elements = composition['elements']
+            all_elements.update(elements)
+            for element, amount in elements.items():
+                if element not in ELEMENTS and not isinstance(element, str):
                     raise TypeError('composition.elements keys must be str, got %r' % type(element))
-                if not isinstance(amount, str):
-                    composition['elements'][element] = str(amount)
+                if type(amount) is not str:
+                    elements[element] = str(amount)
 
         substituted_elements = set()
         if substitution_dict is not None:
@@ -98,42 +135,75 @@ class MaterialInformation(object):
 
         self.non_volatile_elements = {}
         self.other_elements = {}
+        self._found_components = None
+        self._decompose_chemicals = None
+        self._exchange_chemicals = None
 
         self._parse()
 
+        # Element sets and dictionaries never change after parsing,
+        # compute them only once.
+        self._nv_elements = frozenset(self.non_volatile_elements)
+        self._v_elements = frozenset(self.other_elements)
+        self._all_elements = self._nv_elements | self._v_elements
+        # Read-only, materials are shared through _cached_material_info()
+        self._all_elements_dict = MappingProxyType(
+            {**self.non_volatile_elements, **self.other_elements})
+        # Bit i is set if the element at ELEMENT_INDEX i is non volatile in this material
+        self._nv_mask = sum(1 << ELEMENT_INDEX[x] for x in self._nv_elements)
+
+        # Sparse (element, amount) representation used to fill linear equations
+        self._sparse = tuple(self._all_elements_dict.items())
+        self._is_numeric = all(
+            isinstance(amount, (int, float)) or amount.is_number for _, amount in self._sparse)
+        # Packed (element indices, amounts) arrays of numeric materials
+        if self._is_numeric:
+            self._packed = (
+                numpy.array([ELEMENT_INDEX[x] for x, _ in self._sparse], dtype=numpy.int16),
+                numpy.array([float(x) for _, x in self._sparse], dtype=numpy.float64))
+        else:
+            self._packed = None
+
     def _parse(self):
+        elements_set = ELEMENTS
+        nv_elements_set = NON_VOLATILE_ELEMENTS
+        substitution_dict = self.substitution_dict
+
         for component in self.material_composition:
             try:
-                fraction = parse_expr(component['amount'])
+                fraction = _cached_parse(component['amount'])
             except (SyntaxError, TokenError):
                 raise FormulaException(
                     'Sympy cannot parse component molar fraction: %s'
                     % component['amount'])
 
             for element, amount_s in component['elements'].items():
-                element = self.substitution_dict.get(element, element)
+                element = substitution_dict.get(element, element)
 
                 try:
-                    amount = parse_expr(amount_s)
+                    amount = _cached_parse(amount_s)
                 except (SyntaxError, TokenError):
                     raise FormulaException(
                         'Sympy cannot parse element amount: %s'
                         % amount_s)
 
-                if element not in ELEMENTS:
+                if element not in elements_set:
                     raise FormulaException(
                         '%s is not a valid chemical element' % element)
+                element = sys.intern(element)
 
-                if element in NON_VOLATILE_ELEMENTS:
-                    if element not in self.non_volatile_elements:
-                        self.non_volatile_elements[element] = fraction * amount
-                    else:
-                        self.non_volatile_elements[element] += fraction * amount
+                # Integer amounts stay exact Python ints, sympy arithmetic
+                # is only used when symbols are involved.
+                value = fraction * amount
+
+                if element in nv_elements_set:
+                    elements = self.non_volatile_elements
+                else:
+                    elements = self.other_elements
+                if element not in elements:
+                    elements[element] = value
                 else:
-                    if element not in self.other_elements:
-                        self.other_elements[element] = fraction * amount
-                    else:
-                        self.other_elements[element] += fraction * amount
+                    elements[element] += value
 
     def __str__(self):
         return '<MaterialInformation for %s>' % self.material_formula
@@ -146,144 +216,218 @@ class MaterialInformation(object):
 
     @property
     def nv_elements_dict(self):
-        return self.non_volatile_elements
+        return MappingProxyType(self.non_volatile_elements)
 
     @property
     def nv_elements(self):
-        return set(self.non_volatile_elements.keys())
+        return self._nv_elements
+
+    @property
+    def nv_elements_mask(self):
+        """
+        Bit mask of non volatile elements, one bit per element in
+        periodic_table.ELEMENT_INDEX. Subset checks of non volatile
+        elements are a single integer operation on masks.
+        """
+        return self._nv_mask
 
     @property
     def v_elements_dict(self):
-        return self.other_elements
+        return MappingProxyType(self.other_elements)
 
     @property
     def v_elements(self):
-        return set(self.other_elements.keys())
+        return self._v_elements
 
     @property
     def all_elements_dict(self):
-        a = self.non_volatile_elements.copy()
-        a.update(self.other_elements)
-        return a
+        return self._all_elements_dict
+
+    @property
+    def sparse_elements(self):
+        """
+        Tuple of (element, amount) pairs of all elements in this material.
+        """
+        return self._sparse
+
+    @property
+    def packed_elements(self):
+        """
+        Tuple of (indices, amounts) arrays of all elements in this material,
+        indices are rows in periodic_table.ELEMENT_INDEX. None if any
+        amount contains symbols.
+        """
+        return self._packed
+
+    @property
+    def is_numeric(self):
+        """
+        Whether all element amounts are numbers, i.e. contain no symbols.
+        """
+        return self._is_numeric
 
     @property
     def all_elements(self):
-        return self.nv_elements | self.v_elements
+        return self._all_elements
 
     @staticmethod
-    def _compare_composition(comp1, comp2):
-        if comp1.keys() != comp2.keys() or len(comp1) == 0:
+    def _compare_composition(comp1, comp2, comp2_keys=None):
+        """
+        Check whether comp1 is a multiple of comp2. Amounts are compared
+        exactly as fractions by cross multiplication with the first element.
+        comp2_keys is an optional precomputed frozenset of comp2's keys.
+        """
+        if comp2_keys is None:
+            comp2_keys = comp2.keys()
+        if len(comp1) == 0 or comp1.keys() != comp2_keys:
             return False
-        scaling = set()
+        ref1 = ref2 = None
         for k in comp1:
             try:
-                value1, value2 = float(comp1[k]), float(comp2[k])
-            except ValueError:
+                value1, value2 = Fraction(comp1[k]), Fraction(comp2[k])
+            except (ValueError, TypeError):
                 return False
-            scaling.add(value1 / value2)
-        return len(scaling) == 1
-
-    def _component_search_helper(self, target_comp, exclude_nv=False):
-        for comp in self.material_composition:
-            if exclude_nv:
-                subset = {x: y for x, y in comp['elements'].items() if x not in NON_VOLATILE_ELEMENTS}
-            else:
-                subset = comp['elements']
-            if self._compare_composition(subset, target_comp):
-                return True
-        return False
+            if ref1 is None:
+                ref1, ref2 = value1, value2
+            elif value1 * ref2 != value2 * ref1:
+                return False
+        return True
+
+    def _find_components(self):
+        """
+        Compare every component against all known chemical groups
+        (acetate, nitrate, ...) in a single pass. The names of the
+        groups found are computed once and memorized.
+        """
+        if self._found_components is None:
+            found = set()
+            for comp in self.material_composition:
+                volatile = {}
+                for element, amount in comp['elements'].items():
+                    if element in NON_VOLATILE_ELEMENTS:
+                        continue
+                    try:
+                        volatile[element] = Fraction(amount)
+                    except (ValueError, TypeError):
+                        volatile[element] = None
+
+                for name, target_comp, target_keys in self._COMPONENT_GROUPS:
+                    if name not in found and self._compare_composition(
+                            volatile, target_comp, target_keys):
+                        found.add(name)
+            self._found_components = frozenset(found)
+        return self._found_components
 
     @property
     def is_hco(self):
-        return self.all_elements == {'C', 'H', 'O'}
+        # C, H and O are all volatile elements.
+        other = self.other_elements
+        return (not self.non_volatile_elements and len(other) == 3 and
+                'C' in other and 'H' in other and 'O' in other)
 
-    _COMP_WATER = {'H': 2, 'O': 1}
+    _COMP_WATER = MappingProxyType({'H': 2, 'O': 1})
 
     @property
     def has_water(self):
-        has_combined_water = self._component_search_helper(self._COMP_WATER)
-
-        has_hydrogen = False
-        for comp in self.material_composition:
-            if 'H' in comp['elements']:
-                has_hydrogen = True
+        # A component matching _COMP_WATER always contains hydrogen, so
+        # looking for hydrogen is enough; no composition comparison needed.
+        return any('H' in comp['elements'] for comp in self.material_composition)
 
-        return has_combined_water or has_hydrogen
-
-    _COMP_ACETATE = {'C': 2, 'H': 3, 'O': 2}
-    _COMP_ACETATE_CHARGED = {'C': 2, 'H': 3, 'O': 2, 'e-': 1}
+    _COMP_ACETATE = MappingProxyType({'C': 2, 'H': 3, 'O': 2})
+    _COMP_ACETATE_CHARGED = MappingProxyType({'C': 2, 'H': 3, 'O': 2, 'e-': 1})
 
     @property
     def has_acetate(self):
-        return self._component_search_helper(
-            self._COMP_ACETATE, exclude_nv=True)
+        return 'acetate' in self._find_components()
 
-    _COMP_NITRATE = {'N': 1, 'O': 3}
-    _COMP_NITRATE_CHARGED = {'N': 1, 'O': 3, 'e-': 1}
+    _COMP_NITRATE = MappingProxyType({'N': 1, 'O': 3})
+    _COMP_NITRATE_CHARGED = MappingProxyType({'N': 1, 'O': 3, 'e-': 1})
 
     @property
     def has_nitrate(self):
-        return self._component_search_helper(
-            self._COMP_NITRATE, exclude_nv=True)
+        return 'nitrate' in self._find_components()
 
-    _COMP_HYDROXIDE = {'H': 1, 'O': 1}
-    _COMP_HYDROXIDE_CHARGED = {'H': 1, 'O': 1, 'e-': 1}
+    _COMP_HYDROXIDE = MappingProxyType({'H': 1, 'O': 1})
+    _COMP_HYDROXIDE_CHARGED = MappingProxyType({'H': 1, 'O': 1, 'e-': 1})
 
     @property
     def has_hydroxide(self):
-        return self._component_search_helper(
-            self._COMP_HYDROXIDE, exclude_nv=True)
+        return 'hydroxide' in self._find_components()
 
-    _COMP_CARBONATE = {'C': 1, 'O': 3}
+    _COMP_CARBONATE = MappingProxyType({'C': 1, 'O': 3})
 
     @property
     def has_carbonate(self):
-        return self._component_search_helper(
-            self._COMP_CARBONATE, exclude_nv=True)
+        return 'carbonate' in self._find_components()
 
-    _COMP_AMMONIUM = {'H': 4, 'N': 1}
-    _COMP_AMMONIUM_CHARGED = {'H': 4, 'N': 1, 'e-': -1}
+    _COMP_AMMONIUM = MappingProxyType({'H': 4, 'N': 1})
+    _COMP_AMMONIUM_CHARGED = MappingProxyType({'H': 4, 'N': 1, 'e-': -1})
 
     @property
     def has_ammonium(self):
-        return self._component_search_helper(
-            self._COMP_AMMONIUM, exclude_nv=True)
+        return 'ammonium' in self._find_components()
+
+    # Chemical groups searched in the volatile elements of each component
+    _COMPONENT_GROUPS = (
+        ('acetate', _COMP_ACETATE, frozenset(_COMP_ACETATE)),
+        ('nitrate', _COMP_NITRATE, frozenset(_COMP_NITRATE)),
+        ('hydroxide', _COMP_HYDROXIDE, frozenset(_COMP_HYDROXIDE)),
+        ('carbonate', _COMP_CARBONATE, frozenset(_COMP_CARBONATE)),
+        ('ammonium', _COMP_AMMONIUM, frozenset(_COMP_AMMONIUM)),
+    )
+
+    _COMP_CO2 = MappingProxyType({'C': 1, 'O': 2})
+    _COMP_AMMONIA = MappingProxyType({'H': 3, 'N': 1})
+    _COMP_OXYGEN = MappingProxyType({'O': 2})
+
+    # Chemicals released by each chemical group. Groups that dissolve in
+    # solution also bring [OH-] and H2O.
+    _DECOMPOSE_CHEMICALS = {
+        'acetate': {
+            '[CH3COO-]': _COMP_ACETATE_CHARGED,
+            '[OH-]': _COMP_HYDROXIDE_CHARGED,
+            'H2O': _COMP_WATER,
+        },
+        'nitrate': {
+            '[NO3-]': _COMP_NITRATE_CHARGED,
+            '[OH-]': _COMP_HYDROXIDE_CHARGED,
+            'H2O': _COMP_WATER,
+        },
+        'hydroxide': {
+            '[OH-]': _COMP_HYDROXIDE_CHARGED,
+            'H2O': _COMP_WATER,
+        },
+        'carbonate': {
+            'CO2': _COMP_CO2,
+        },
+    }
 
     @property
     def decompose_chemicals(self):
-        decompose = {}
+        if self._decompose_chemicals is not None:
+            return self._decompose_chemicals
 
-        def add_solution_chemicals():
-            decompose['[OH-]'] = self._COMP_HYDROXIDE_CHARGED
-            decompose['H2O'] = self._COMP_WATER
+        decompose = {}
 
         # Find whether there are water or not
         if self.has_water:
             decompose['H2O'] = self._COMP_WATER
 
-        if self.has_acetate:
-            decompose['[CH3COO-]'] = self._COMP_ACETATE_CHARGED
-            add_solution_chemicals()
-
-        if self.has_nitrate:
-            decompose['[NO3-]'] = self._COMP_NITRATE_CHARGED
-            add_solution_chemicals()
-
-        if self.has_hydroxide:
-            decompose['[OH-]'] = self._COMP_HYDROXIDE_CHARGED
-            add_solution_chemicals()
-
-        if self.has_carbonate:
-            decompose['CO2'] = {'C': 1, 'O': 2}
+        for group in self._find_components():
+            decompose.update(self._DECOMPOSE_CHEMICALS.get(group, ()))
 
         # FIXME: material_string is different from material_formula! How to better determine decompose chemicals?
         if 'NH4' in self.material_formula:
-            decompose['NH3'] = {'H': 3, 'N': 1}
+            decompose['NH3'] = self._COMP_AMMONIA
 
-        return decompose
+        self._decompose_chemicals = MappingProxyType(decompose)
+        return self._decompose_chemicals
 
     @property
     def exchange_chemicals(self):
+        if self._exchange_chemicals is not None:
+            return self._exchange_chemicals
+
         absorption = {}
 
         # This justifies the usage of O2 for oxide synthesis
@@ -293,6 +437,30 @@ class MaterialInformation(object):
         # using only O2: if O2 appears at the LHS, the element is
         # oxidized, if O2 appears at the RHS, the element is reduced.
         if 'O' in self.v_elements:
-            absorption['O2'] = {'O': 2}
-
-        return absorption
+            absorption['O2'] = self._COMP_OXYGEN
+
+        self._exchange_chemicals = MappingProxyType(absorption)
+        return self._exchange_chemicals
+
+
+@lru_cache(maxsize=4096)
+def _cached_material_info(material_string, material_formula, compositions, sub_items):
+    return MaterialInformation(
+        material_string, material_formula,
+        [{'amount': amount, 'elements': dict(elements)} for amount, elements in compositions],
+        dict(sub_items) if sub_items is not None else None)
+
+
+def material_dict_to_info(material_dict, sub_dict=None):
+    """
+    Convert a material dictionary into MaterialInformation. Results are
+    memorized, so the same material/substitution is parsed only once.
+    """
+    compositions = tuple(
+        (comp['amount'], tuple(sorted(comp['elements'].items())))
+        for comp in material_dict['composition'])
+    sub_items = tuple(sorted(sub_dict.items())) if sub_dict is not None else None
+    return _cached_material_info(
+        material_dict['material_string'],
+        material_dict['material_formula'],
+        compositions, sub_items)
@@ -1,6 +1,7 @@
 import json
 import operator
 import os
+import sys
 import warnings
 from functools import reduce
 
@@ -8,9 +9,9 @@ __author__ = 'Haoyan Huo'
 __maintainer__ = 'Haoyan Huo'
 __email__ = 'haoyan.huo@lbl.gov'
 
-__all__ = ['NON_VOLATILE_ELEMENTS', 'ELEMENTS', 'PT', 'PT_LIST']
+__all__ = ['NON_VOLATILE_ELEMENTS', 'ELEMENTS', 'ELEMENT_INDEX', 'PT', 'PT_LIST']
 
-NON_VOLATILE_ELEMENTS = {
+NON_VOLATILE_ELEMENTS = frozenset({
     'Li', 'Be',
     'Na', 'Mg', 'Al', 'Si', 'P', 'S', 'Cl',
     'K', 'Ca', 'Sc', 'Ti', 'V', 'Cr', 'Mn', 'Fe', 'Co', 'Ni', 'Cu', 'Zn', 'Ga', 'Ge', 'As',
@@ -19,17 +20,20 @@ NON_VOLATILE_ELEMENTS = {
     'Ta', 'W', 'Re', 'Os', 'Ir', 'Pt', 'Au', 'Hg', 'Tl', 'Pb', 'Bi', 'Po', 'At',
     'Fr', 'Ra', 'Ac', 'Th', 'Pa', 'U', 'Np', 'Pu', 'Am', 'Cm', 'Bk', 'Cf', 'Es', 'Fm', 'Md', 'No', 'Lr', 'Rf', 'Db',
     'Sg', 'Bh', 'Hs', 'Mt', 'Ds', 'Rg', 'Cn', 'Nh', 'Fl', 'Mc', 'Lv', 'Ts'
-}
+})
 
-ELEMENTS = set(
+# Element symbols are interned so that dictionaries keyed by them compare by identity
+ELEMENTS = frozenset(map(sys.intern, (
     'H|He|'
     'Li|Be|B|C|N|O|F|Ne|'
     'Na|Mg|Al|Si|P|S|Cl|Ar|'
     'K|Ca|Sc|Ti|V|Cr|Mn|Fe|Co|Ni|Cu|Zn|Ga|Ge|As|Se|Br|Kr|'
     'Rb|Sr|Y|Zr|Nb|Mo|Tc|Ru|Rh|Pd|Ag|Cd|In|Sn|Sb|Te|I|Xe|'
     'Cs|Ba|La|Ce|Pr|Nd|Pm|Sm|Eu|Gd|Tb|Dy|Ho|Er|Tm|Yb|Lu|Hf|Ta|W|Re|Os|Ir|Pt|Au|Hg|Tl|Pb|Bi|Po|At|Rn|'
-    'Fr|Ra|Ac|Th|Pa|U|Np|Pu|Am|Cm|Bk|Cf|Es|Fm|Md|No|Lr|Rf|Db|Sg|Bh|Hs|Mt|Ds|Rg'.split('|')
-)
+    'Fr|Ra|Ac|Th|Pa|U|Np|Pu|Am|Cm|Bk|Cf|Es|Fm|Md|No|Lr|Rf|Db|Sg|Bh|Hs|Mt|Ds|Rg').split('|')))
+
+# Fixed row index of every element, used by packed element arrays
+ELEMENT_INDEX = {element: i for i, element in enumerate(sorted(ELEMENTS))}
 
 
 def _patch_pt(pt):
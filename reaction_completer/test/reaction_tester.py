@@ -1,8 +1,14 @@
 import re
+import sys
+from functools import lru_cache
 from unittest import TestCase
 
 from reaction_completer.driver import balance_recipe
 
+_SEMICOLON_RE = re.compile(r'\s*;\s*')
+_PLUS_RE = re.compile(r'\s\+\s')
+_COMMA_RE = re.compile(r'\s*,\s*')
+
 
 def simple_parse(composition_string):
     """
@@ -27,48 +33,48 @@ def simple_parse(composition_string):
     8. Each substitution is "Var:value1,value2..."
     9. Additives are separated by and "&"
     """
-    composition_string = re.sub(r'\s', '', composition_string)
-
-    additives = []
-    if '<' in composition_string:
-        composition_string, additives_string = composition_string.split('<')
-        additives = additives_string.split('&')
-
-    elements_vars = {}
-    if '?' in composition_string:
-        composition_string, elements_vars_string = composition_string.split('?')
+    components, elements_vars, additives = _parse_composition(composition_string)
+    material_composition = [
+        {'amount': amount, 'elements': dict(elements)}
+        for amount, elements in components]
+    elements_vars = {element: list(values) for element, values in elements_vars}
+    return material_composition, elements_vars, list(additives)
+
+
+@lru_cache(maxsize=None)
+def _parse_composition(composition_string):
+    # Test materials repeat a lot, parse each string only once into
+    # immutable tuples. simple_parse() returns fresh copies.
+    composition_string = ''.join(composition_string.split())
+
+    composition_string, sep, additives_string = composition_string.partition('<')
+    additives = tuple(additives_string.split('&')) if sep else ()
+
+    composition_string, sep, elements_vars_string = composition_string.partition('?')
+    elements_vars = []
+    if sep:
         for element_var in elements_vars_string.split(';'):
-            element, values = element_var.split(':')
-            elements_vars[element] = values.split(',')
-
-    compositions = composition_string.split(';')
-    material_composition = []
-    for composition in compositions:
-        parts = composition.split('--', maxsplit=1)
-        if len(parts) == 1:
-            comp_amount, elements = '1.0', parts[0]
-        else:
-            comp_amount, elements = parts
-        elements_dict = {}
+            element, _, values = element_var.partition(':')
+            elements_vars.append((element, tuple(values.split(','))))
+
+    components = []
+    for composition in composition_string.split(';'):
+        comp_amount, sep, elements = composition.partition('--')
+        if not sep:
+            comp_amount, elements = '1.0', comp_amount
+        elements_items = []
         for pair in elements.split('+'):
-            parts = pair.split(':', maxsplit=1)
-            if len(parts) == 1:
-                element, amount = parts[0], '1.0'
-            else:
-                element, amount = parts
-            elements_dict[element] = amount
-        material_composition.append({
-            'amount': comp_amount,
-            'elements': elements_dict
-        })
-    return material_composition, elements_vars, additives
+            element, sep, amount = pair.partition(':')
+            elements_items.append((sys.intern(element), amount if sep else '1.0'))
+        components.append((comp_amount, tuple(elements_items)))
+    return tuple(components), tuple(elements_vars), additives
 
 
 def make_material(data):
     material_formula, material_string, composition_string = data
     composition, elements_vars, additives = simple_parse(composition_string)
     return {
-        'material_formula': material_formula,
+        'material_formula': sys.intern(material_formula),
         'material_string': material_string,
         'composition': composition,
         'elements_vars': elements_vars,
@@ -89,20 +95,19 @@ class TestReaction(TestCase):
 
     @staticmethod
     def _parse_equation(eq):
-        parts = re.split(r'\s*;\s*', eq)
+        # Sorted tuples instead of sets: sets only have a partial order,
+        # so sorting lists of them is not deterministic.
+        parts = _SEMICOLON_RE.split(eq)
         left, right = parts[0].split(' == ')
-        left = set(re.split(r'\s\+\s', left))
-        right = set(re.split(r'\s\+\s', right))
+        left = tuple(sorted(_PLUS_RE.split(left)))
+        right = tuple(sorted(_PLUS_RE.split(right)))
 
         if len(parts) > 1:
-            substitutions = set(re.split(r'\s*,\s*', parts[1]))
+            substitutions = tuple(sorted(_COMMA_RE.split(parts[1])))
         else:
-            substitutions = set()
+            substitutions = ()
 
-        if len(parts) > 2:
-            additives = parts[2:]
-        else:
-            additives = set()
+        additives = tuple(parts[2:])
 
         return left, right, substitutions, additives
 
@@ -0,0 +1,38 @@
+import csv
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from reaction_completer.cli import main
+from reaction_completer.test.reaction_tester import make_material, make_materials
+
+
+class TestCli(TestCase):
+    def test_main(self):
+        record = {
+            'precursors': make_materials([
+                ('BaCO3', 'BaCO3', 'Ba:1.0+C:1.0+O:3.0'),
+                ('TiO2', 'TiO2', 'Ti:1.0+O:2.0'),
+            ]),
+            'target': make_material(('BaTiO3', 'BaTiO3', 'Ba:1.0+Ti:1.0+O:3.0')),
+        }
+        data = [
+            {'extracted_data': [record, dict(record, precursors=[])]},
+            {'extracted_data': [record]},
+        ]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, 'data.json')
+            output_path = os.path.join(tmp_dir, 'reactions.csv')
+            with open(input_path, 'w') as f:
+                json.dump(data, f)
+
+            main(input_path, output_path, limit=1, processes=1)
+            with open(output_path, newline='') as f:
+                rows = list(csv.reader(f))
+
+        self.assertListEqual(rows, [
+            ['reaction', 'precursors', 'targets'],
+            ['1 BaCO3 + 1 TiO2 == 1 BaTiO3 + 1 CO2', 'BaCO3, TiO2', 'BaTiO3'],
+        ])
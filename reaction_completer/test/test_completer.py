@@ -1,4 +1,13 @@
-from reaction_completer.test.reaction_tester import TestReaction
+from unittest import TestCase
+
+from reaction_completer import (
+    MaterialInformation, ReactionCompleter, TooManyPrecursors,
+    balance_recipe, balance_recipe_cached, balance_recipes)
+from reaction_completer import _backend
+from reaction_completer._backend import _solution_cache
+from reaction_completer._cache import LRUCache
+from reaction_completer.driver import _reaction_cache
+from reaction_completer.test.reaction_tester import TestReaction, make_materials
 
 
 class TestSolutionBased(TestReaction):
@@ -81,6 +90,19 @@ class TestSimple(TestReaction):
             '1 CuO·H2O + 0.5 Cr2O3 == 1 CuCrO2 + 0.75 O2 + 1 H2O'
         ])
 
+    def test_dopant_rounding(self):
+        reactions = self.balance_equation([
+            ('BaCO3', 'BaCO3', 'Ba:1.0+C:1.0+O:3.0'),
+            ('TiO2', 'TiO2', 'Ti:1.0+O:2.0'),
+            ('ZrO2', 'ZrO2', 'Zr:1.0+O:2.0'),
+        ], [
+            ('BaTi0.0375Zr0.9625O3', 'BaTi0.0375Zr0.9625O3', 'Ba:1+Ti:0.0375+Zr:0.9625+O:3')
+        ])
+
+        self.assertReactionsEqual(reactions, [
+            '1 BaCO3 + 0.038 TiO2 + 0.962 ZrO2 == 1 BaTi0.0375Zr0.9625O3 + 1 CO2'
+        ])
+
 
 class TestElementSubstitution(TestReaction):
     def test_simple(self):
@@ -106,3 +128,163 @@ class TestElementSubstitution(TestReaction):
             '6 Fe2O3 + 6 SrCO3 == 1 Sr6(A2O4)6 + 6 CO2; A = Fe ; target Sr6(A2O4)6 with additives Mn2+ via MnO',
             '6 Al2O3 + 6 SrCO3 == 1 Sr6(A2O4)6 + 6 CO2; A = Al ; target Sr6(A2O4)6 with additives Mn2+ via MnO'
         ])
+
+
+class TestReactionCache(TestReaction):
+    def test_cached_result_not_shared(self):
+        precursors = [
+            ("BaCO3", "BaCO3", "Ba:1.0+C:1.0+O:3.0"),
+            ("TiO2", "TiO2", "Ti:1.0+O:2.0"),
+        ]
+        targets = [
+            ("BaTiO3", "BaTiO3", "Ba:1.0+Ti:1.0+O:3.0"),
+        ]
+        reactions = self.balance_equation(precursors, targets)
+        reactions[0][1]['left'].clear()
+
+        reactions = self.balance_equation(precursors, targets)
+        self.assertDictEqual(reactions[0][1], {
+            'left': {'BaCO3': '1', 'TiO2': '1'},
+            'right': {'BaTiO3': '1', 'CO2': '1'},
+        })
+
+    def test_lru_cache(self):
+        cache = LRUCache(2, copy=list)
+        self.assertListEqual(cache.get('a', lambda: [1]), [1])
+        cache.get('b', lambda: [2])
+        cache.get('a', lambda: [0]).append(3)
+        cache.get('c', lambda: [3])
+
+        self.assertNotIn('b', cache)
+        self.assertEqual(len(cache), 2)
+        self.assertListEqual(cache.get('a', lambda: [0]), [1])
+
+    def test_substitutions_share_solution(self):
+        _reaction_cache.clear()
+        reactions = self.balance_equation([
+            ('SrCO3', 'SrCO3', 'Sr:1.0+C:1.0+O:3.0'),
+            ('Al2O3', 'Al2O3', 'Al:2.0+O:3.0'),
+            ('Fe2O3', 'Fe2O3', 'Fe:2.0+O:3.0'),
+        ], [
+            ('Sr6(A2O4)6', 'Sr6(A2O4)6', 'A:12.0+O:24.0+Sr:6.0?A:Fe,Al'),
+        ])
+
+        self.assertEqual(len(_reaction_cache), 1)
+        self.assertReactionsEqual(reactions, [
+            '6 Fe2O3 + 6 SrCO3 == 1 Sr6(A2O4)6 + 6 CO2; A = Fe',
+            '6 Al2O3 + 6 SrCO3 == 1 Sr6(A2O4)6 + 6 CO2; A = Al',
+        ])
+
+    def test_precursor_named_as_target(self):
+        _reaction_cache.clear()
+        self.balance_equation([
+            ('BaTiO3', 'BaCO3', 'Ba:1.0+C:1.0+O:3.0'),
+            ('TiO2', 'TiO2', 'Ti:1.0+O:2.0'),
+        ], [
+            ('BaTiO3', 'BaTiO3', 'Ba:1.0+Ti:1.0+O:3.0'),
+        ])
+        reactions = self.balance_equation([
+            ('BaCO3', 'BaCO3', 'Ba:1.0+C:1.0+O:3.0'),
+            ('TiO2', 'TiO2', 'Ti:1.0+O:2.0'),
+        ], [
+            ('BaTiO3', 'BaTiO3', 'Ba:1.0+Ti:1.0+O:3.0'),
+        ])
+
+        self.assertReactionsEqual(reactions, [
+            '1 BaCO3 + 1 TiO2 == 1 BaTiO3 + 1 CO2'
+        ])
+
+    def test_cached_recipe(self):
+        precursors = make_materials([
+            ("BaCO3", "BaCO3", "Ba:1.0+C:1.0+O:3.0"),
+            ("TiO2", "TiO2", "Ti:1.0+O:2.0"),
+        ])
+        targets = make_materials([
+            ("BaTiO3", "BaTiO3", "Ba:1.0+Ti:1.0+O:3.0"),
+        ])
+        reactions = balance_recipe_cached(precursors, targets)
+        self.assertListEqual(reactions, balance_recipe(precursors, targets))
+        reactions[0][1]['left'].clear()
+
+        self.assertListEqual(balance_recipe_cached(precursors, targets),
+                             balance_recipe(precursors, targets))
+
+    def test_balance_recipes(self):
+        precursors = make_materials([
+            ("BaCO3", "BaCO3", "Ba:1.0+C:1.0+O:3.0"),
+            ("TiO2", "TiO2", "Ti:1.0+O:2.0"),
+            ("ZrO2", "ZrO2", "Zr:1.0+O:2.0"),
+        ])
+        targets = make_materials([
+            ("BaTiO3", "BaTiO3", "Ba:1.0+Ti:1.0+O:3.0"),
+            ("BaZrO3", "BaZrO3", "Ba:1.0+Zr:1.0+O:3.0"),
+        ])
+        recipes = [(precursors, [target]) for target in targets]
+        expected = [balance_recipe(*recipe) for recipe in recipes]
+
+        self.assertListEqual(list(balance_recipes(recipes, processes=1)), expected)
+        self.assertListEqual(list(balance_recipes(recipes, processes=2, chunksize=1)), expected)
+
+
+class TestCompleter(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Materials are shared by all tests of this class.
+        def material(formula, elements):
+            return MaterialInformation(formula, formula, {'amount': '1.0', 'elements': elements})
+
+        cls.batio3 = material('BaTiO3', {'Ba': '1.0', 'Ti': '1.0', 'O': '3.0'})
+        cls.baco3 = material('BaCO3', {'Ba': '1.0', 'C': '1.0', 'O': '3.0'})
+        cls.bao = material('BaO', {'Ba': '1.0', 'O': '1.0'})
+        cls.tio2 = material('TiO2', {'Ti': '1.0', 'O': '2.0'})
+        cls.zro2 = material('ZrO2', {'Zr': '1.0', 'O': '2.0'})
+
+    def test_is_feasible(self):
+        self.assertTrue(ReactionCompleter.is_feasible([self.baco3, self.tio2], self.batio3))
+        self.assertTrue(ReactionCompleter.is_feasible([self.baco3, self.tio2, self.zro2], self.batio3))
+        self.assertFalse(ReactionCompleter.is_feasible([self.baco3, self.zro2], self.batio3))
+        self.assertFalse(ReactionCompleter.is_feasible([self.baco3], self.tio2))
+
+    def test_compute_reactions(self):
+        completer = ReactionCompleter([self.baco3, self.tio2, self.zro2], self.batio3)
+        self.assertDictEqual(completer.compute_reactions(), {
+            'left': {'BaCO3': '1', 'TiO2': '1'},
+            'right': {'BaTiO3': '1', 'CO2': '1'},
+        })
+
+    def test_too_many_precursors(self):
+        completer = ReactionCompleter([self.baco3, self.bao, self.tio2], self.batio3)
+        self.assertRaises(TooManyPrecursors, completer.compute_reactions)
+
+    def test_symbolic_solution_cached(self):
+        _solution_cache.clear()
+        srco3 = MaterialInformation(
+            'SrCO3', 'SrCO3', {'amount': '1.0', 'elements': {'Sr': '1.0', 'C': '1.0', 'O': '3.0'}})
+        target = MaterialInformation(
+            'Ba1-xSrxTiO3', 'Ba1-xSrxTiO3',
+            {'amount': '1.0', 'elements': {'Ba': '1-x', 'Sr': 'x', 'Ti': '1.0', 'O': '3.0'}})
+
+        reactions = [
+            ReactionCompleter([self.baco3, srco3, self.tio2], target).compute_reactions()
+            for _ in range(2)]
+        self.assertEqual(len(_solution_cache), 1)
+        self.assertDictEqual(reactions[0], reactions[1])
+        self.assertDictEqual(reactions[0]['left'], {'BaCO3': '1-x', 'SrCO3': 'x', 'TiO2': '1'})
+
+    def test_symbolic_precursor_backends(self):
+        axb = MaterialInformation('AxB', 'AxB', {'amount': '1.0', 'elements': {'Ba': 'x', 'Ti': '1.0', 'O': '2.0'}})
+        expected = {
+            'left': {'AxB': '1', 'BaO': '1-x', 'O2': '0.5*x'},
+            'right': {'BaTiO3': '1'},
+        }
+
+        # Both with SymEngine (if installed) and with sympy only.
+        for symengine in (None, False):
+            with self.subTest(symengine=symengine):
+                _solution_cache.clear()
+                _backend._symengine = symengine
+                try:
+                    completer = ReactionCompleter([axb, self.bao], self.batio3)
+                    self.assertDictEqual(completer.compute_reactions(), expected)
+                finally:
+                    _backend._symengine = None
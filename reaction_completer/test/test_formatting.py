@@ -0,0 +1,12 @@
+from unittest import TestCase
+
+import sympy
+
+from reaction_completer.formatting import simplify_print
+
+
+class TestSimplifyPrint(TestCase):
+    def test_float(self):
+        self.assertEqual(simplify_print(sympy.Float(3.0)), '3')
+        self.assertEqual(simplify_print(sympy.Float(0.0375)), '0.038')
+        self.assertEqual(simplify_print(sympy.Float(-2.5e20)), '-250000000000000000000')
@@ -1,6 +1,9 @@
 from unittest import TestCase
 
-from reaction_completer import MaterialInformation
+from reaction_completer import MaterialInformation, balance_recipe
+from reaction_completer.material import material_dict_to_info
+from reaction_completer.periodic_table import ELEMENT_INDEX
+from reaction_completer.test.reaction_tester import make_materials
 
 
 class TestMaterialParsing(TestCase):
@@ -15,3 +18,73 @@ class TestMaterialParsing(TestCase):
         )
         self.assertSetEqual(material.nv_elements, {"Ba", "Ti"})
         self.assertSetEqual(material.v_elements, {"O"})
+
+    def test_sparse_elements(self):
+        material = MaterialInformation(
+            "Sm1-xSrxCoO3", "Sm1-xSrxCoO3",
+            {
+                "amount": "1.0",
+                "elements": {"Sm": "1-x", "Sr": "x", "Co": "1.0", "O": "3.0"},
+            }
+        )
+        self.assertSetEqual({x for x, _ in material.sparse_elements}, {"Sm", "Sr", "Co", "O"})
+        self.assertFalse(material.is_numeric)
+        self.assertIsNone(material.packed_elements)
+
+        material = MaterialInformation(
+            "BaTiO3", "BaTiO3",
+            {
+                "amount": "1.0",
+                "elements": {"Ba": "1.0", "Ti": "1.0", "O": "3.0"},
+            }
+        )
+        self.assertTrue(material.is_numeric)
+        indices, amounts = material.packed_elements
+        self.assertDictEqual(
+            dict(zip(indices.tolist(), amounts.tolist())),
+            {ELEMENT_INDEX['Ba']: 1.0, ELEMENT_INDEX['Ti']: 1.0, ELEMENT_INDEX['O']: 3.0})
+        self.assertEqual(
+            material.nv_elements_mask,
+            (1 << ELEMENT_INDEX['Ba']) | (1 << ELEMENT_INDEX['Ti']))
+
+    def test_components(self):
+        material = MaterialInformation(
+            "Co(NO3)2·6H2O", "Co(NO3)2·6H2O",
+            [
+                {"amount": "1.0", "elements": {"Co": "1.0", "N": "2.0", "O": "6.0"}},
+                {"amount": "6.0", "elements": {"H": "2.0", "O": "1.0"}},
+            ]
+        )
+        self.assertTrue(material.has_water)
+        self.assertTrue(material.has_nitrate)
+        self.assertFalse(material.has_acetate)
+        self.assertFalse(material.has_carbonate)
+        self.assertSetEqual(set(material.decompose_chemicals), {"H2O", "[OH-]", "[NO3-]"})
+
+    def test_shared_dicts_read_only(self):
+        precursors = make_materials([
+            ("BaCO3", "BaCO3", "Ba:1.0+C:1.0+O:3.0"),
+            ("TiO2", "TiO2", "Ti:1.0+O:2.0"),
+        ])
+        targets = make_materials([
+            ("BaTiO3", "BaTiO3", "Ba:1.0+Ti:1.0+O:3.0"),
+        ])
+        baco3 = material_dict_to_info(precursors[0])
+        batio3 = material_dict_to_info(targets[0])
+
+        with self.assertRaises(TypeError):
+            baco3.decompose_chemicals['CO2'] = {}
+        with self.assertRaises(TypeError):
+            baco3.decompose_chemicals['CO2']['C'] = 2
+        with self.assertRaises(TypeError):
+            batio3.exchange_chemicals['O2']['O'] = 1
+        with self.assertRaises(TypeError):
+            batio3.all_elements_dict['Ba'] = 2
+        with self.assertRaises(TypeError):
+            batio3.nv_elements_dict['Ba'] = 2
+        with self.assertRaises(TypeError):
+            batio3.v_elements_dict['O'] = 2
+        self.assertRaises(AttributeError, lambda: baco3.decompose_chemicals.clear())
+
+        reactions = balance_recipe(precursors, targets)
+        self.assertEqual(reactions[0][3], '1 BaCO3 + 1 TiO2 == 1 BaTiO3 + 1 CO2')
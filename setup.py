@@ -14,7 +14,10 @@ if __name__ == "__main__":
         packages=find_packages(),
         zip_safe=False,
         install_requires=[
+            'numpy',
             'sympy',
-            'nltk',
-        ]
+        ],
+        extras_require={
+            'symengine': ['symengine'],
+        }
     )